@@ -8,23 +8,30 @@ Usage:
   #       python delete_idle_by_type.py v6e-8
 
 Runs the same logic as `tou` (wrap_master.py) to get current TPU list, parses [IDLE] lines,
-filters by type (substring match in VM name), then deletes each with gcloud.
+filters by type (substring match in VM name), then deletes each through the Cloud TPU REST API.
 Asks for confirmation before deleting.
 """
 
+import http.client
 import os
 import re
+import signal
 import subprocess
 import sys
-from multiprocessing import Pool
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
-# Normalize shorthand to substring that appears in VM names (e.g. v5-8 -> v5p-8 for common case)
-# Strip ANSI escape sequences so regex can match (master.py colors [IDLE] and TPU name).
-def _strip_ansi(text: str) -> str:
-    return re.sub(r"\033\[[0-9;]*m", "", text)
+# Matches: [IDLE] <tpu-name> (<zone>)
+# master.py colors [IDLE] and the TPU name on the console, so ANSI escape sequences are
+# tolerated around them; the captured output can be scanned as-is without stripping.
+_ANSI = r"(?:\033\[[0-9;]*m)*"
+_IDLE_RE = re.compile(
+    r"\[IDLE\]" + _ANSI + r"\s+" + _ANSI + r"([^\s\033]+)" + _ANSI + r"\s+\(([^)]+)\)"
+)
 
 
+# Normalize shorthand to substring that appears in VM names (e.g. v5-8 -> v5p-8 for common case)
 TYPE_ALIASES = {
     "v5-8": "v5p-8",
     "v6-8": "v6e-8",
@@ -36,31 +43,74 @@ TYPE_ALIASES = {
     "v5-128": "v5p-128",
 }
 
-DELETE_WORKERS = 8  # parallel gcloud delete processes
+DELETE_WORKERS = 32  # parallel delete requests (threads just wait on HTTP)
 DELETE_TIMEOUT = 120
+LIST_TIMEOUT = 300
+LIST_READ_HINT = 64 * 1024  # bytes of wrap_master.py output scanned per findall
+
+TPU_API_HOST = "tpu.googleapis.com"
+
+# One keep-alive HTTPS connection per worker thread, reused across deletes.
+_conn = threading.local()
+
+
+def _gcloud_value(*args) -> str:
+    """Run one gcloud command and return its stripped stdout."""
+    out = subprocess.check_output(
+        ["gcloud", *args], text=True, stdin=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    return out.strip()
+
+
+def _get_api_auth() -> tuple:
+    """Resolve (project, access_token) once, so deletes don't each start a gcloud."""
+    project = _gcloud_value("config", "get-value", "project")
+    token = _gcloud_value("auth", "print-access-token")
+    return project, token
+
+
+def _send_delete(path: str, headers: dict) -> tuple:
+    """Send one DELETE on this thread's keep-alive connection. Returns (status, body)."""
+    conn = getattr(_conn, "conn", None)
+    if conn is None:
+        conn = _conn.conn = http.client.HTTPSConnection(TPU_API_HOST, timeout=DELETE_TIMEOUT)
+    conn.request("DELETE", path, headers=headers)
+    resp = conn.getresponse()
+    return resp.status, resp.read().decode("utf-8", "replace")
 
 
-def _delete_one(tpu: dict) -> tuple:
-    """Delete a single TPU. Returns (status, name, zone, message).
-    status in ('ok', 'timeout', 'fail').
+def _delete_one(tpu: dict, project: str, token: str) -> tuple:
+    """Request deletion of a single TPU through the Cloud TPU REST API.
+    Returns (status, name, zone, message); status in ('ok', 'timeout', 'fail').
+    The API answers with a long-running operation, so 'ok' means the delete was accepted.
     """
     name, zone = tpu["name"], tpu["zone"]
-    cmd = [
-        "gcloud", "compute", "tpus", "tpu-vm", "delete",
-        name,
-        "--zone", zone,
-        "--quiet",
-    ]
+    path = f"/v2/projects/{project}/locations/{zone}/nodes/{name}"
+    headers = {"Authorization": f"Bearer {token}"}
     try:
-        subprocess.run(cmd, check=True, capture_output=True, text=True, timeout=DELETE_TIMEOUT)
-        return ("ok", name, zone, None)
-    except subprocess.TimeoutExpired:
+        try:
+            status, body = _send_delete(path, headers)
+        except ConnectionError:
+            # The server closed this thread's idle keep-alive connection
+            # (RemoteDisconnected etc.); reconnect and retry once.
+            _conn.conn = None
+            status, body = _send_delete(path, headers)
+        if status == 200:
+            return ("ok", name, zone, None)
+        return ("fail", name, zone, f"HTTP {status}: {body.strip()}")
+    except TimeoutError:
+        _conn.conn = None
         return ("timeout", name, zone, None)
     except Exception as e:
+        # Drop the connection so the next delete on this thread reconnects.
+        _conn.conn = None
         return ("fail", name, zone, str(e))
 
 
 def main():
+    # Inherited by wrap_master.py / master.py so their output streams unbuffered.
+    os.environ["PYTHONUNBUFFERED"] = "1"
+
     if len(sys.argv) < 2:
         print("Usage: python delete_idle_by_type.py <tpu_type>")
         print("  e.g.  delete_idle_by_type.py v5p-8   # deletes all IDLE v5p-8 TPUs")
@@ -79,37 +129,35 @@ def main():
         print(f"Error: wrap_master.py not found at {wrap_master}")
         sys.exit(1)
     print("Running TPU list (wrap_master.py)...")
+    # Stream the output and parse [IDLE] lines as they arrive instead of buffering it all.
+    # Parse [IDLE] lines:  ... [IDLE] kmh-tpuvm-v5p-8-spot-xxx (us-central1-a)
+    proc = subprocess.Popen(
+        [sys.executable, wrap_master],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        cwd=script_dir,
+    )
+    # Reading proc.stdout has no timeout of its own, so kill the child when the budget runs out.
+    killer = threading.Timer(LIST_TIMEOUT, proc.kill)
+    killer.start()
+    idle_list = []
     try:
-        result = subprocess.run(
-            [sys.executable, wrap_master],
-            capture_output=True,
-            text=True,
-            timeout=300,
-            cwd=script_dir,
-            env={**os.environ, "PYTHONUNBUFFERED": "1"},
-        )
-        out = result.stdout + result.stderr
-        # print(out)
-    except subprocess.TimeoutExpired:
+        # One C-level findall per batch of complete lines instead of a search per line.
+        for lines in iter(lambda: proc.stdout.readlines(LIST_READ_HINT), []):
+            for name, zone in _IDLE_RE.findall("".join(lines)):
+                # ignore a nopre tpu
+                if 'nopre' in name:
+                    continue
+                if tpu_type in name:
+                    idle_list.append({"name": name, "zone": zone})
+        proc.wait()
+    finally:
+        killer.cancel()
+    if proc.returncode == -signal.SIGKILL:
         print("Error: TPU list command timed out.")
         sys.exit(1)
 
-    # Parse [IDLE] lines:  ... [IDLE] kmh-tpuvm-v5p-8-spot-xxx (us-central1-a)
-    # Strip ANSI color codes from console output so the regex can match.
-    pattern = re.compile(r"\[IDLE\]\s+(\S+)\s+\(([^)]+)\)")
-    idle_list = []
-    for line in out.splitlines():
-        clean = _strip_ansi(line)
-        m = pattern.search(clean)
-        if not m:
-            continue
-        name, zone = m.group(1), m.group(2)
-        # ignore a nopre tpu
-        if 'nopre' in name:
-            continue
-        if tpu_type in name:
-            idle_list.append({"name": name, "zone": zone})
-
     if not idle_list:
         print(f"No IDLE TPUs matching type '{tpu_type}' (input: {raw_type}).")
         sys.exit(0)
@@ -123,21 +171,32 @@ def main():
         print("Aborted.")
         sys.exit(0)
 
+    try:
+        project, token = _get_api_auth()
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Error: failed to get gcloud project/credentials: {e}")
+        sys.exit(1)
+    if not project:
+        print("Error: no gcloud project set (gcloud config set project <PROJECT>).")
+        sys.exit(1)
+
     print(f"Deleting {len(idle_list)} TPUs in parallel (workers={DELETE_WORKERS})...")
-    with Pool(DELETE_WORKERS) as pool:
-        results = pool.map(_delete_one, idle_list)
     success = failed = 0
-    for status, name, zone, msg in results:
-        if status == "ok":
-            print(f"  Deleted: {name} ({zone})")
-            success += 1
-        elif status == "timeout":
-            print(f"  Timeout: {name} ({zone})")
-            failed += 1
-        else:
-            print(f"  Failed:  {name} ({zone}) — {msg}")
-            failed += 1
-    print(f"\nDone: {success} deleted, {failed} failed.")
+    with ThreadPoolExecutor(max_workers=DELETE_WORKERS) as ex:
+        futures = [ex.submit(_delete_one, t, project, token) for t in idle_list]
+        # Report each delete as soon as it finishes rather than after the slowest one.
+        for fut in as_completed(futures):
+            status, name, zone, msg = fut.result()
+            if status == "ok":
+                print(f"  Delete started: {name} ({zone})", flush=True)
+                success += 1
+            elif status == "timeout":
+                print(f"  Timeout: {name} ({zone})", flush=True)
+                failed += 1
+            else:
+                print(f"  Failed:  {name} ({zone}) — {msg}", flush=True)
+                failed += 1
+    print(f"\nDone: {success} delete(s) started, {failed} failed.")
 
 
 if __name__ == "__main__":
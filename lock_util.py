@@ -1,7 +1,10 @@
 import os
+import time
 import datetime
+from functools import lru_cache
 
 LOCK_TIME_FMT = "%Y-%m-%d_%H-%M-%S"
+LOCK_DIR = "/kmh-nfs-ssd-us-mount/code/qiao/tpu_lock"
 RED, GREEN, YELLOW, PURPLE, NC = "\033[1;31m", "\033[1;32m", "\033[1;33m", "\033[1;34m", "\033[0m"
 GOOD, INFO, WARNING, FAIL = f"{GREEN}[GOOD]{NC}", f"{PURPLE}[INFO]{NC}", f"{YELLOW}[WARNING]{NC}", f"{RED}[FAIL]{NC}"
 def get_lock_time_str():
@@ -24,11 +27,76 @@ def _parse_lock_filename(filename):
     vm_name = '_'.join(parts[1:-2])
     return user, vm_name, time_str
 
+def _parse_vm_lock_filename(filename):
+    '''
+    解析 {LOCK_DIR}/{vm_name}/ 下的锁文件名 {user}_{YYYY-MM-DD_HH-MM-SS}。
+    返回 (user, time_str) 或 None（格式不对时）。
+    '''
+    parts = filename.split('_')
+    if len(parts) < 3:
+        return None
+    return parts[0], f"{parts[-2]}_{parts[-1]}"
+
+def _migrate_flat_lock(entry, now_ts, lock_dir=LOCK_DIR):
+    '''
+    处理 lock_dir 下平铺的旧版锁文件 {user}_{vm_name}_{time}（entry 为 os.scandir 的条目）。
+    旧版 zhan 可能仍在别的账号下运行，所以没有"只迁移一次"：每次扫描 lock_dir 时顺带处理。
+    超过 30 分钟的直接删除；其余移到 {lock_dir}/{vm_name}/{user}_{time}，os.replace 不改变 mtime。
+    返回移入的 vm_name，未移动时返回 None。
+    '''
+    if not entry.is_file(follow_symlinks=False):
+        return None
+    parsed = _parse_lock_filename(entry.name)
+    if parsed is None:
+        return None
+    user, vm_name, time_str = parsed
+    try:
+        if now_ts - entry.stat(follow_symlinks=False).st_mtime > 30 * 60:
+            os.remove(entry.path)
+            return None
+        vm_dir = os.path.join(lock_dir, vm_name)
+        _make_vm_dir(vm_dir, lock_dir)
+        os.replace(entry.path, os.path.join(vm_dir, f"{user}_{time_str}"))
+    except OSError:
+        return None
+    return vm_name
+
+def _make_vm_dir(vm_dir, lock_dir=LOCK_DIR):
+    '''
+    创建 {lock_dir}/{vm_name} 目录，权限与 lock_dir 保持一致。
+    lock_dir 由多个账号共享，按 umask 建出来的 0755 目录会让其他人无法在里面加锁 / 删过期锁。
+    只对自己新建的目录 chmod（别人的目录没有权限改）。
+    '''
+    try:
+        os.mkdir(vm_dir)
+    except FileExistsError:
+        return
+    try:
+        os.chmod(vm_dir, os.stat(lock_dir).st_mode & 0o7777)
+    except OSError:
+        pass
+
+def _remove_vm_dir_if_empty(vm_dir):
+    '''
+    删除已经没有锁文件的 {LOCK_DIR}/{vm_name} 目录，避免空目录越积越多（spot TPU 名字不重复）。
+    目录非空或已被删除时 os.rmdir 抛 OSError，直接忽略。
+    '''
+    try:
+        os.rmdir(vm_dir)
+    except OSError:
+        pass
+
+@lru_cache(maxsize=4096)
 def parse_lock_time_str(s):
     """
     解析 get_lock_time_str 返回的字符串为 datetime（UTC）。
+    格式固定为 YYYY-MM-DD_HH-MM-SS，按位置切片解析，比 strptime 快得多；格式不对时抛 ValueError。
     """
-    return datetime.datetime.strptime(s, LOCK_TIME_FMT)
+    if len(s) != 19 or s[4] != '-' or s[7] != '-' or s[10] != '_' or s[13] != '-' or s[16] != '-':
+        raise ValueError(f"invalid lock time string: {s!r}")
+    return datetime.datetime(
+        int(s[0:4]), int(s[5:7]), int(s[8:10]), int(s[11:13]), int(s[14:16]), int(s[17:19])
+    )
 
 def lock_time_seconds_between(time_str_earlier, time_str_later):
     """
@@ -41,49 +109,61 @@ def lock_time_seconds_between(time_str_earlier, time_str_later):
 
 def zhan(user, vm_name):
     '''
-    write a file under /kmh-nfs-ssd-us-mount/code/qiao/tpu_lock,
-    with name {USER_VMNAME_TIME}. Time format: YYYY-MM-DD_HH-MM-SS (no space, underscores).
+    write a file under /kmh-nfs-ssd-us-mount/code/qiao/tpu_lock/{VMNAME},
+    with name {USER_TIME}. Time format: YYYY-MM-DD_HH-MM-SS (no space, underscores).
     do not support when the vm_name is an alias.
     '''
 
     time_str = get_lock_time_str()
     user_vm_name = f"{user}_{vm_name}_{time_str}"
-    lock_dir = "/kmh-nfs-ssd-us-mount/code/qiao/tpu_lock"
-    with open(f"{lock_dir}/{user_vm_name}", 'w') as f:
-        f.write(f"{user}_{vm_name}_{time_str}")
+    vm_dir = os.path.join(LOCK_DIR, vm_name)
+    path = os.path.join(vm_dir, f"{user}_{time_str}")
+    # 空目录可能刚好被过期清理 rmdir 掉，此时重建一次
+    for attempt in range(2):
+        _make_vm_dir(vm_dir)
+        try:
+            with open(path, 'w') as f:
+                f.write(f"{user}_{vm_name}_{time_str}")
+            break
+        except FileNotFoundError:
+            if attempt == 1:
+                raise
+    # 过期判断以 mtime 为准：显式写入本机时间，避免 NFS 服务器时钟与客户端不一致
+    now = time.time()
+    os.utime(path, (now, now))
     print(f'{GOOD} 成功创建了叫做{user_vm_name}的占卡锁')
 
 
 def check_reserved_user(tpu):
     '''
-    Check the path /kmh-nfs-ssd-us-mount/code/qiao/tpu_lock, and see whether there is a file
-    named {USER_VMNAME_TIME} within 30 minutes. If a file is older than 30 minutes, delete it.
+    Check the path /kmh-nfs-ssd-us-mount/code/qiao/tpu_lock/{tpu}, and see whether there is a file
+    named {USER_TIME} within 30 minutes. If a file is older than 30 minutes, delete it.
     Return the reserved user name, otherwise return None.
     Time format: YYYY-MM-DD_HH-MM-SS (no space, underscores).
     '''
-    now = get_lock_time_str()
-    lock_dir = "/kmh-nfs-ssd-us-mount/code/qiao/tpu_lock"
-    for file in os.listdir(lock_dir):
-        parsed = _parse_lock_filename(file)
-        if parsed is None:
-            continue
-        user, vm_name, time_str = parsed
-        if vm_name != tpu:
-            continue
-        try:
-            seconds_ago = lock_time_seconds_between(time_str, now)
-        except (ValueError, TypeError):
-            # 旧格式或非法时间，视为过期并删除
-            try:
-                os.remove(f"{lock_dir}/{file}")
-            except OSError:
-                pass
-            continue
-        if seconds_ago > 30 * 60:
+    # 用文件 mtime 判断过期：只扫描这台 VM 自己的子目录，不再对每个文件做 strptime
+    now_ts = time.time()
+    vm_dir = os.path.join(LOCK_DIR, tpu)
+    try:
+        it = os.scandir(vm_dir)
+    except FileNotFoundError:
+        return None
+    with it:
+        for entry in it:
+            parsed = _parse_vm_lock_filename(entry.name)
+            if parsed is None:
+                continue
+            user, _ = parsed
             try:
-                os.remove(f"{lock_dir}/{file}")
+                mtime = entry.stat().st_mtime
             except OSError:
-                pass
-            continue
-        return user
+                continue
+            if now_ts - mtime > 30 * 60:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+                continue
+            return user
+    _remove_vm_dir_if_empty(vm_dir)
     return None
\ No newline at end of file
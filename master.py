@@ -1,17 +1,29 @@
+import atexit
+import base64
+import hashlib
+import json
 import time
 import subprocess
 import logging
+import logging.handlers
 import os
+import queue
 import sys
-from multiprocessing import Pool
-from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 import re
-from lock_util import _parse_lock_filename, get_lock_time_str, lock_time_seconds_between
+from lock_util import (
+    _migrate_flat_lock,
+    _parse_vm_lock_filename,
+    _remove_vm_dir_if_empty,
+)
 
 # ================= 配置区域 =================
 
 CHECK_INTERVAL = 300
-MAX_WORKERS = 10
+# 审计线程池大小：线程只等待 gcloud 子进程，但每个任务都是一个完整的 gcloud Python 进程（加上 ssh 子进程），
+# 并发受审计机内存限制
+MAX_WORKERS = 48
+MOUNT_WORKERS = 10
 
 ZONES = [
     "us-central1-a",
@@ -33,11 +45,30 @@ OTHER_PREFIX = "__OTHER__"
 LOG_PATH = "/kmh-nfs-ssd-us-mount/code/qiao/work/tpu_dls/tpu_enforcer.log"
 LOCK_DIR = "/kmh-nfs-ssd-us-mount/code/qiao/tpu_lock"
 LOCK_EXPIRE_SECONDS = 30 * 60
+# 刚加锁（60 秒内）且上一轮 SSH 检查为 IDLE 的 TPU 跳过本轮 SSH 检查
+RESERVED_SKIP_SECONDS = 60
 
 TPU_MANAGER_DIR = "/kmh-nfs-ssd-us-mount/code/zhichengjiang/working/xibo_tpu_manager"
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 CACHE_FILE = os.path.join(SCRIPT_DIR, ".tpu_audit_cache")
+# 短期复用 TPU 列表：窗口内重复审计不再重新跑 gcloud list
+LIST_CACHE_FILE = os.path.join(SCRIPT_DIR, ".tpu_list_cache.json")
+LIST_CACHE_SECONDS = 60
+
+# 复用 SSH 连接：同一 TPU 的后续审计走已建立的 ControlMaster 通道，省去握手
+# %C 是连接参数的哈希，长度固定，避免长主机名超出 unix socket 路径上限（108 字节）
+SSH_CONTROL_PATH = "~/.ssh/cm-%C"
+SSH_CONTROL_PERSIST = 600
+
+# SSH 预算：连续失败 HEALTH_FAIL_THRESHOLD 次的 TPU 改用短超时，避免每轮都耗满 40s
+SSH_TIMEOUT = 40
+FAST_SSH_TIMEOUT = 10
+FAST_SSH_CONNECT_TIMEOUT = 5
+HEALTH_FAIL_THRESHOLD = 2
+# 短超时的 TPU 每 HEALTH_FULL_CHECK_EVERY 次连续失败给一次完整 40s 预算，慢恢复的机器能重新变回健康
+HEALTH_FULL_CHECK_EVERY = 4
+HEALTH_FILE = os.path.join(SCRIPT_DIR, ".tpu_health.json")
 
 # TPU names containing any of these keywords will be skipped by auto register/mount.
 AUTO_REGISTER_MOUNT_SKIP_KEYWORDS = ("katelyn", "victor", "zander", "xtiange")
@@ -56,23 +87,17 @@ class IdleOnlyFormatter(logging.Formatter):
     # Matches: [RESERVED] <tpu-name>
     RESERVED_PATTERN = re.compile(r"(\[RESERVED\])\s+([^\s]+)")
 
+    # Substitution templates instead of Python callbacks, so re.sub stays in C.
+    IDLE_REPL = f"{GREEN}\\1{RESET} {GREEN}\\2{RESET}"
+    RESERVED_REPL = f"{YELLOW}\\1{RESET} {YELLOW}\\2{RESET}"
+
     def format(self, record):
         msg = super().format(record)
-
-        def repl_idle(m):
-            return (
-                f"{self.GREEN}{m.group(1)}{self.RESET} "
-                f"{self.GREEN}{m.group(2)}{self.RESET}"
-            )
-
-        def repl_reserved(m):
-            return (
-                f"{self.YELLOW}{m.group(1)}{self.RESET} "
-                f"{self.YELLOW}{m.group(2)}{self.RESET}"
-            )
-
-        msg = self.IDLE_PATTERN.sub(repl_idle, msg)
-        msg = self.RESERVED_PATTERN.sub(repl_reserved, msg)
+        # Most records carry neither tag; skip the regex entirely for them.
+        if "[IDLE]" in msg:
+            msg = self.IDLE_PATTERN.sub(self.IDLE_REPL, msg)
+        if "[RESERVED]" in msg:
+            msg = self.RESERVED_PATTERN.sub(self.RESERVED_REPL, msg)
         return msg
 
 
@@ -83,17 +108,24 @@ def setup_logging():
 
     fmt = "%(asctime)s [%(levelname)s] %(message)s"
 
-    # File: plain text (NO ANSI)
+    # File: plain text (NO ANSI). LOG_PATH is on NFS, so records go through a queue
+    # and a listener thread does the writes off the audit's critical path.
     fh = logging.FileHandler(LOG_PATH)
     fh.setLevel(logging.INFO)
     fh.setFormatter(logging.Formatter(fmt))
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, fh)
+    listener.start()
+    atexit.register(listener.stop)
+    qh = logging.handlers.QueueHandler(log_queue)
+    qh.setLevel(logging.INFO)
 
     # Console: ONLY highlight [IDLE] + TPU name
     ch = logging.StreamHandler()
     ch.setLevel(logging.INFO)
     ch.setFormatter(IdleOnlyFormatter(fmt))
 
-    logger.addHandler(fh)
+    logger.addHandler(qh)
     logger.addHandler(ch)
 
 
@@ -103,35 +135,50 @@ setup_logging()
 # ---------------- Utilities ----------------
 
 _TIMEOUT_RE = re.compile(r"\[TIMEOUT\]\s+(\S+)")
+# [IDLE] and the TPU name are colored on the console, and the cache holds the console
+# output, so ANSI escape sequences are tolerated around them.
+_ANSI = r"(?:\033\[[0-9;]*m)*"
+_IDLE_RE = re.compile(r"\[IDLE\]" + _ANSI + r"\s+" + _ANSI + r"([^\s\033]+)")
 
 
-def _read_cache_timeout_tpus() -> set:
-    """Read cache file and return set of TPU names that had [TIMEOUT] in the previous run."""
+def _read_cache_output() -> tuple:
+    """
+    Return (cached_time, output) of the previous run from the cache file.
+    (None, "") if the cache is missing or invalid.
+    """
     try:
         with open(CACHE_FILE, "r", encoding="utf-8") as f:
             content = f.read()
         lines = content.split("\n", 1)
-        output = lines[1] if len(lines) > 1 else ""
+        return float(lines[0]), (lines[1] if len(lines) > 1 else "")
     except (OSError, ValueError):
+        return None, ""
+
+
+def _cache_timeout_tpus(output: str) -> set:
+    """Return set of TPU names that had [TIMEOUT] in the previous run."""
+    # One pass over the whole cached output instead of a search per line.
+    return set(_TIMEOUT_RE.findall(output))
+
+
+def _cache_idle_tpus(cached_time, output: str) -> set:
+    """
+    Return set of TPU names that were really SSH-checked [IDLE] in the previous run.
+    (cached) RESERVED lines don't count, so a skipped TPU is checked again next run;
+    a cache older than one audit interval says nothing about "last run" and is ignored.
+    """
+    if cached_time is None or time.time() - cached_time > CHECK_INTERVAL:
         return set()
+    return set(_IDLE_RE.findall(output))
 
-    timed_out = set()
-    for line in output.splitlines():
-        m = _TIMEOUT_RE.search(line)
-        if m:
-            timed_out.add(m.group(1))
-    return timed_out
+
+# States that are never audited. PREEMPTED is listed separately because those TPUs are
+# still fetched (for deletion); the rest are filtered out server-side by gcloud.
+SKIP_STATES = frozenset({"TERMINATED", "CREATING", "DELETING", "REPAIRING", "STOPPED"})
 
 
 def should_skip_tpu(name: str, zone: str, state: str) -> bool:
-    if state in {
-        "PREEMPTED",
-        "TERMINATED",
-        "CREATING",
-        "DELETING",
-        "REPAIRING",
-        "STOPPED",
-    }:
+    if state == "PREEMPTED" or state in SKIP_STATES:
         return True
 
     # Special ignore
@@ -151,12 +198,21 @@ def delete_preempted_tpu(tpu_info: dict):
     Delete a single PREEMPTED TPU.
     tpu_info: {"name": ..., "zone": ..., "state": ...}
 
-    Return: (status, name, zone)
+    The delete is submitted with --async: gcloud returns as soon as the API has accepted
+    it, so the audit is not held up by the delete itself. DELETE_SUCCESS therefore means
+    the delete operation was started; the TPU shows up as DELETING (and is skipped)
+    until it is gone.
+
+    Return: (status, name, zone, log_msg)
       status in {"DELETE_SUCCESS", "DELETE_TIMEOUT", "DELETE_FAIL"}
+    The caller logs log_msg together with the other results in one record.
     """
     name = tpu_info["name"]
     zone = tpu_info["zone"]
 
+    # The cached TPU list would otherwise replay this TPU to the next run in the window.
+    _invalidate_list_cache()
+
     cmd = [
         "gcloud",
         "compute",
@@ -166,33 +222,78 @@ def delete_preempted_tpu(tpu_info: dict):
         name,
         "--zone",
         zone,
+        "--async",
         "--quiet",
+        "--format=value(name)",
     ]
 
     try:
-        subprocess.run(cmd, check=True, capture_output=True, text=True, timeout=60)
-        logging.info(f"[DELETE] Successfully deleted PREEMPTED TPU: {name} ({zone})")
-        return ("DELETE_SUCCESS", name, zone)
+        res = subprocess.run(cmd, check=True, capture_output=True, text=True, timeout=60)
+        op = res.stdout.strip()
+        msg = f"[DELETE] Started deleting PREEMPTED TPU: {name} ({zone}) op={op}"
+        return ("DELETE_SUCCESS", name, zone, msg)
     except subprocess.TimeoutExpired:
-        logging.info(f"[DELETE] Timeout deleting {name} ({zone})")
-        return ("DELETE_TIMEOUT", name, zone)
+        msg = f"[DELETE] Timeout deleting {name} ({zone})"
+        return ("DELETE_TIMEOUT", name, zone, msg)
     except Exception as e:
-        logging.info(f"[DELETE] Failed to delete {name} ({zone}): {e}")
-        return ("DELETE_FAIL", name, zone)
+        msg = f"[DELETE] Failed to delete {name} ({zone}): {e}"
+        return ("DELETE_FAIL", name, zone, msg)
 
 
-def list_tpus_in_zone(zone: str):
-    """
-    List all ACTIVE TPUs (after skip policy) in a zone.
-    Also collect PREEMPTED TPUs for deletion.
+def _read_list_cache():
+    """Return the cached TPU rows if LIST_CACHE_FILE is fresh, else None."""
+    try:
+        if time.time() - os.stat(LIST_CACHE_FILE).st_mtime > LIST_CACHE_SECONDS:
+            return None
+        with open(LIST_CACHE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _invalidate_list_cache():
+    """Drop the cached TPU list, e.g. once a delete changes the inventory."""
+    try:
+        os.remove(LIST_CACHE_FILE)
+    except OSError:
+        pass
+
+
+def _write_list_cache(rows):
+    tmp = f"{LIST_CACHE_FILE}.{os.getpid()}"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(rows, f)
+        os.replace(tmp, LIST_CACHE_FILE)
+    except OSError:
+        logging.info("[ALL] failed to write TPU list cache")
 
-    Return: (active_tpus, preempted_tpus)
-      - active_tpus: list of {name, zone}
-      - preempted_tpus: list of {name, zone, state}
+
+def _read_health():
     """
-    active_results = []
-    preempted_results = []
-    cmd = [
+    Return {name: {"last_ok": ts, "consec_fail": n, "full_timeout": bool}} from
+    HEALTH_FILE ({} if missing). full_timeout records whether the TPU's most recent
+    full-budget check timed out; short fast_fail checks leave it unchanged.
+    """
+    try:
+        with open(HEALTH_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_health(health):
+    tmp = f"{HEALTH_FILE}.{os.getpid()}"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(health, f)
+        os.replace(tmp, HEALTH_FILE)
+    except OSError:
+        logging.info("[HEALTH] failed to write TPU health file")
+
+
+def _list_cmd(zone: str):
+    return [
         "gcloud",
         "compute",
         "tpus",
@@ -200,34 +301,85 @@ def list_tpus_in_zone(zone: str):
         "list",
         "--zone",
         zone,
+        f"--filter=NOT state:({' '.join(sorted(SKIP_STATES))})",
         "--format=value(name,state)",
     ]
 
-    try:
-        out = subprocess.check_output(cmd, text=True, stderr=subprocess.DEVNULL)
-        for line in out.splitlines():
-            if not line.strip():
-                continue
-            parts = line.split("\t")
-            if len(parts) < 2:
-                continue
-            name, state = parts[0].strip(), parts[1].strip()
-
-            # Collect PREEMPTED TPUs for deletion
-            if state == "PREEMPTED":
-                preempted_results.append({"name": name, "zone": zone, "state": state})
-                continue
-
-            # apply skip policy for active TPUs
-            if should_skip_tpu(name, zone, state):
-                continue
-
-            active_results.append({"name": name, "zone": zone})
 
-    except Exception as e:
-        logging.info(f"[ALL] {zone}: list failed ({e})")
+def iter_all_tpus():
+    """
+    Yield TPUs across ZONES, as gcloud prints them.
 
-    return (active_results, preempted_results)
+    One gcloud list runs per zone, all started at once; their output is read zone by
+    zone, so a zone's rows are handed out as soon as that listing finishes while the
+    other zones keep running. TPUs in SKIP_STATES are filtered out by gcloud.
+
+    A successful listing is saved to LIST_CACHE_FILE; a run within LIST_CACHE_SECONDS
+    of it replays the saved rows instead of calling gcloud again.
+
+    Yields:
+      - active TPUs (after skip policy): {name, zone}
+      - PREEMPTED TPUs for deletion: {name, zone, state}
+    A zone whose listing fails is logged and skipped.
+    """
+    cached = _read_list_cache()
+    if cached is not None:
+        logging.info(f"[ALL] using TPU list cached within {LIST_CACHE_SECONDS}s")
+        yield from cached
+        return
+
+    rows = []
+    all_ok = True
+    procs = []
+    for zone in ZONES:
+        try:
+            proc = subprocess.Popen(
+                _list_cmd(zone), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+            )
+        except Exception as e:
+            logging.info(f"[ALL] {zone}: list failed ({e})")
+            all_ok = False
+            continue
+        procs.append((zone, proc))
+
+    for zone, proc in procs:
+        try:
+            # Stream rows as gcloud prints them instead of buffering the whole listing.
+            for line in proc.stdout:
+                if not line.strip():
+                    continue
+                parts = line.split("\t")
+                if len(parts) < 2:
+                    continue
+                name, state = parts[0].strip(), parts[1].strip()
+
+                # Collect PREEMPTED TPUs for deletion
+                if state == "PREEMPTED":
+                    task = {"name": name, "zone": zone, "state": state}
+                # apply skip policy for active TPUs
+                elif should_skip_tpu(name, zone, state):
+                    continue
+                else:
+                    task = {"name": name, "zone": zone}
+
+                # Callers annotate the yielded dict, so cache a copy. PREEMPTED rows are
+                # not cached: this run deletes them, and a replay would resubmit the delete.
+                if "state" not in task:
+                    rows.append(dict(task))
+                yield task
+
+            if proc.wait() != 0:
+                raise subprocess.CalledProcessError(proc.returncode, _list_cmd(zone))
+
+        except Exception as e:
+            logging.info(f"[ALL] {zone}: list failed ({e})")
+            all_ok = False
+        finally:
+            proc.stdout.close()
+
+    # A partial listing is not cached, so the next run asks gcloud for the missing zone.
+    if all_ok:
+        _write_list_cache(rows)
 
 
 def assign_prefix(name: str, prefixes):
@@ -244,56 +396,127 @@ def assign_prefix(name: str, prefixes):
 def collect_recent_reservations():
     """
     Scan all lock files once and return fresh reservations:
-      {vm_name: user}
-    Expired or invalid lock files are deleted.
+      {vm_name: (user, lock_mtime)}
+    Lock files live in one subdirectory per TPU: LOCK_DIR/{vm_name}/{user}_{time}.
+    Expiry is judged by file mtime (stamped by zhan), as in check_reserved_user.
+    Expired lock files are deleted.
+
+    Old copies of zhan still write flat LOCK_DIR/{user}_{vm_name}_{time} files; the
+    top-level listing moves those into their subdirectory (or deletes them if expired)
+    in the same pass, so they are counted without another scan of LOCK_DIR.
     """
     reservations = {}
-    now = get_lock_time_str()
+    now_ts = time.time()
 
+    vm_names = set()
     try:
-        files = os.listdir(LOCK_DIR)
+        with os.scandir(LOCK_DIR) as it:
+            for e in it:
+                if e.is_dir(follow_symlinks=False):
+                    vm_names.add(e.name)
+                else:
+                    migrated = _migrate_flat_lock(e, now_ts, LOCK_DIR)
+                    if migrated is not None:
+                        vm_names.add(migrated)
     except OSError as e:
         logging.info(f"[LOCK] list failed ({e})")
         return reservations
 
-    for file in files:
-        parsed = _parse_lock_filename(file)
-        full_path = os.path.join(LOCK_DIR, file)
-        if parsed is None:
-            continue
-
-        user, vm_name, time_str = parsed
+    for vm_name in vm_names:
+        vm_path = os.path.join(LOCK_DIR, vm_name)
         try:
-            seconds_ago = lock_time_seconds_between(time_str, now)
-        except (ValueError, TypeError):
-            # Old/invalid timestamp format, treat as expired.
-            try:
-                os.remove(full_path)
-            except OSError:
-                pass
+            it = os.scandir(vm_path)
+        except OSError:
             continue
 
-        if seconds_ago > LOCK_EXPIRE_SECONDS:
-            try:
-                os.remove(full_path)
-            except OSError:
-                pass
-            continue
+        with it:
+            for entry in it:
+                parsed = _parse_vm_lock_filename(entry.name)
+                if parsed is None:
+                    continue
+                user, _ = parsed
+                try:
+                    mtime = entry.stat(follow_symlinks=False).st_mtime
+                except OSError:
+                    continue
+
+                if now_ts - mtime > LOCK_EXPIRE_SECONDS:
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+                    continue
+
+                # Keep the newest valid reservation for this TPU.
+                if vm_name not in reservations or mtime > reservations[vm_name][1]:
+                    reservations[vm_name] = (user, mtime)
 
-        # Keep the first valid reservation encountered for this TPU.
         if vm_name not in reservations:
-            reservations[vm_name] = user
+            _remove_vm_dir_if_empty(vm_path)
 
     return reservations
 
 
 # ---------------- Core check ----------------
 
+# Audit script run on every worker. It is installed once per TPU under a path keyed by
+# its content hash, so each SSH only sends the short run command; editing the script
+# changes the path and triggers a reinstall.
+AUDIT_SCRIPT = (
+    "PID=$(sudo lsof -t /dev/accel* /dev/vfio/* 2>/dev/null | head -n 1); "
+    'if [ -z "$PID" ]; then echo "CHECK_RES:IDLE"; '
+    'else TPU_USER=$(ps -o user= -p "$PID"); echo "CHECK_RES:BUSY|USER:$TPU_USER"; fi; '
+    '[ -f /home/sqa/.disk_mounted ] && echo "MOUNT_RES:MOUNTED" || echo "MOUNT_RES:NOT_MOUNTED"\n'
+)
+_AUDIT_SCRIPT_PATH = (
+    f"/usr/local/bin/tpu_audit_{hashlib.sha1(AUDIT_SCRIPT.encode()).hexdigest()[:8]}.sh"
+)
+_AUDIT_RUN_CMD = (
+    f"if [ -f {_AUDIT_SCRIPT_PATH} ]; then bash {_AUDIT_SCRIPT_PATH}; "
+    "else echo AUDIT_SCRIPT_MISSING; fi"
+)
+_AUDIT_INSTALL_CMD = (
+    f"echo {base64.b64encode(AUDIT_SCRIPT.encode()).decode()} | base64 -d "
+    f"| sudo tee {_AUDIT_SCRIPT_PATH} >/dev/null && sudo chmod 755 {_AUDIT_SCRIPT_PATH}; "
+    f"bash {_AUDIT_SCRIPT_PATH}"
+)
+
+# Fixed BUSY line written by AUDIT_SCRIPT: CHECK_RES:BUSY|USER:<user>
+_BUSY_RE = re.compile(r"CHECK_RES:BUSY\|USER:([^|\s]*)")
+
+
+def _audit_ssh_cmd(name, zone, remote_cmd, connect_timeout=None):
+    cmd = [
+        "gcloud",
+        "compute",
+        "tpus",
+        "tpu-vm",
+        "ssh",
+        name,
+        "--zone",
+        zone,
+        "--worker=all",
+        "--ssh-flag=-n",
+        "--ssh-flag=-oControlMaster=auto",
+        f"--ssh-flag=-oControlPath={SSH_CONTROL_PATH}",
+        f"--ssh-flag=-oControlPersist={SSH_CONTROL_PERSIST}",
+    ]
+    if connect_timeout is not None:
+        cmd.append(f"--ssh-flag=-oConnectTimeout={connect_timeout}")
+    cmd += ["--command", remote_cmd]
+    return cmd
+
 
 def check_single_tpu(tpu: dict):
     """
     tpu dict:
-      {"name":..., "zone":..., "prefix":...}
+      {"name":..., "zone":..., "prefix":..., "fast_fail": bool (optional)}
+
+    fast_fail is set for TPUs that failed the last HEALTH_FAIL_THRESHOLD checks, except on
+    every HEALTH_FULL_CHECK_EVERY-th consecutive failure; they get a short budget, and
+    running out of it is reported as SSH_FAIL rather than TIMEOUT so the short budget
+    alone can never trigger the persistent-TIMEOUT delete. A full-budget check that
+    runs out is always TIMEOUT.
 
     Return:
       (prefix, name, zone, status, message)
@@ -302,64 +525,43 @@ def check_single_tpu(tpu: dict):
     name = tpu["name"]
     zone = tpu["zone"]
     prefix = tpu["prefix"]
+    fast_fail = tpu.get("fast_fail", False)
+    if fast_fail:
+        timeout, connect_timeout = FAST_SSH_TIMEOUT, FAST_SSH_CONNECT_TIMEOUT
+    else:
+        timeout, connect_timeout = SSH_TIMEOUT, None
 
-    remote_cmd = (
-        "PID=$(sudo lsof -t /dev/accel* /dev/vfio/* 2>/dev/null | head -n 1); "
-        'if [ -z "$PID" ]; then echo "CHECK_RES:IDLE"; '
-        'else TPU_USER=$(ps -o user= -p "$PID"); echo "CHECK_RES:BUSY|USER:$TPU_USER"; fi; '
-        '[ -f /home/sqa/.disk_mounted ] && echo "MOUNT_RES:MOUNTED" || echo "MOUNT_RES:NOT_MOUNTED"'
-    )
-
-    ssh_cmd = [
-        "gcloud",
-        "compute",
-        "tpus",
-        "tpu-vm",
-        "ssh",
-        name,
-        "--zone",
-        zone,
-        "--worker=all",
-        "--ssh-flag=-n",
-        "--command",
-        remote_cmd,
-    ]
+    ssh_cmd = _audit_ssh_cmd(name, zone, _AUDIT_RUN_CMD, connect_timeout)
 
     try:
-        res = subprocess.run(ssh_cmd, capture_output=True, text=True, timeout=40)
+        # One deadline covers both the run and, if needed, the install-and-run call.
+        deadline = time.monotonic() + timeout
+        res = subprocess.run(ssh_cmd, capture_output=True, text=True, timeout=timeout)
+        if res.returncode == 0 and "AUDIT_SCRIPT_MISSING" in res.stdout:
+            # First audit of this TPU (or the script changed): install it, then run it.
+            ssh_cmd = _audit_ssh_cmd(name, zone, _AUDIT_INSTALL_CMD, connect_timeout)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(ssh_cmd, timeout)
+            res = subprocess.run(ssh_cmd, capture_output=True, text=True, timeout=remaining)
 
         if res.returncode != 0:
             msg = f"[{prefix}] [SSH_FAIL] {name}: {res.stderr.strip()}"
             return (prefix, name, zone, "SSH_FAIL", msg, None)
 
-        users = set()
-        saw_check = False
-        saw_busy = False
+        # Scan the whole output with substring checks and one regex pass instead of
+        # splitting it into lines (--worker=all output includes SSH banners).
+        out = res.stdout
+        saw_check = "CHECK_RES:" in out
+        users = {m.group(1) for m in _BUSY_RE.finditer(out)}
+        saw_busy = bool(users)
         # Any worker reporting NOT_MOUNTED means disk needs mounting.
-        disk_mounted = None
-        for line in res.stdout.splitlines():
-            if "MOUNT_RES:" in line:
-                payload = line.split("MOUNT_RES:")[1].strip()
-                if payload == "NOT_MOUNTED":
-                    disk_mounted = False
-                elif payload == "MOUNTED" and disk_mounted is None:
-                    disk_mounted = True
-                continue
-
-            if "CHECK_RES:" not in line:
-                continue
-
-            saw_check = True
-            payload = line.split("CHECK_RES:")[1].strip()
-
-            if payload == "IDLE":
-                continue
-
-            if payload.startswith("BUSY"):
-                saw_busy = True
-                for part in payload.split("|"):
-                    if part.startswith("USER:"):
-                        users.add(part.split(":", 1)[1])
+        if "MOUNT_RES:NOT_MOUNTED" in out:
+            disk_mounted = False
+        elif "MOUNT_RES:MOUNTED" in out:
+            disk_mounted = True
+        else:
+            disk_mounted = None
 
         if not saw_check:
             msg = f"[{prefix}] [ERROR] {name}: no CHECK_RES in output"
@@ -373,6 +575,9 @@ def check_single_tpu(tpu: dict):
         return (prefix, name, zone, "BUSY", msg, disk_mounted)
 
     except subprocess.TimeoutExpired:
+        if fast_fail:
+            msg = f"[{prefix}] [SSH_FAIL] {name}: no response within {timeout}s (failing repeatedly)"
+            return (prefix, name, zone, "SSH_FAIL", msg, None)
         msg = f"[{prefix}] [TIMEOUT] {name} ({zone})"
         return (prefix, name, zone, "TIMEOUT", msg, None)
     except Exception as e:
@@ -453,8 +658,8 @@ def _spawn_mount_workers(tpus_to_mount):
         fh.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
         logging.getLogger().addHandler(fh)
 
-        with Pool(min(MAX_WORKERS, len(tpus_to_mount))) as pool:
-            pool.map(_do_mount_single, tpus_to_mount)
+        with ThreadPoolExecutor(max_workers=min(MOUNT_WORKERS, len(tpus_to_mount))) as pool:
+            list(pool.map(_do_mount_single, tpus_to_mount))
     except Exception:
         pass
     finally:
@@ -464,160 +669,205 @@ def _spawn_mount_workers(tpus_to_mount):
 # ---------------- Main runner ----------------
 
 
-def run_audit_all(prefixes):
-    logging.info("=== TPU idle/busy audit start ===")
-
-    # Phase 1: list all TPUs in all zones (parallel by zone)
-    with Pool(MAX_WORKERS) as pool:
-        zone_results = pool.map(list_tpus_in_zone, ZONES)
+# Statuses counted as "bad" in the summary.
+BAD_STATUSES = frozenset({"ERROR", "TIMEOUT", "SSH_FAIL", "TIMEOUT_DELETED"})
 
-    # Separate active TPUs and PREEMPTED TPUs
-    all_tpus = []
-    all_preempted = []
-    for active_list, preempted_list in zone_results:
-        all_tpus.extend(active_list)
-        all_preempted.extend(preempted_list)
 
-    if not all_tpus and not all_preempted:
-        logging.info("No TPU found.")
-        return
+def run_audit_all(prefixes, pool):
+    """
+    Run one full audit cycle. `pool` is a ThreadPoolExecutor owned by the caller
+    and reused across cycles.
+    """
+    logging.info("=== TPU idle/busy audit start ===")
 
-    # Assign prefix (including OTHER) for active TPUs
-    for t in all_tpus:
-        t["prefix"] = assign_prefix(t["name"], prefixes)
+    # Scan the lock directory (on NFS) in the background while gcloud starts up.
+    reservations_future = pool.submit(collect_recent_reservations)
+    cached_time, cache_output = _read_cache_output()
+    cache_timeout_tpus = _cache_timeout_tpus(cache_output)
+    cache_idle_tpus = _cache_idle_tpus(cached_time, cache_output)
+    health = _read_health()
+
+    # Phase 1 + 2 fused: list all TPUs in all zones (one concurrent gcloud call per
+    # zone) and hand each one to the pool as soon as its row arrives, so deletes of
+    # PREEMPTED TPUs and checks of active TPUs start while the listing is still
+    # running. Every task just waits on a gcloud subprocess, so threads are enough.
+    delete_futures = []
+    check_futures = []
+    fast_fail_names = set()
+    reservations = None
+    for task in iter_all_tpus():
+        if "state" in task:
+            delete_futures.append(pool.submit(process_task, task))
+            continue
 
-    # Phase 2: Delete PREEMPTED TPUs + Check active TPUs in SAME pool (parallel)
-    all_tasks = []
+        name, zone = task["name"], task["zone"]
+        prefix = task["prefix"] = assign_prefix(name, prefixes)
+        if reservations is None:
+            reservations = reservations_future.result()
+        # A TPU reserved within RESERVED_SKIP_SECONDS that was SSH-checked IDLE last run
+        # is reported as RESERVED without an SSH check; older reservations are checked.
+        if (
+            name in reservations
+            and time.time() - reservations[name][1] < RESERVED_SKIP_SECONDS
+            and name in cache_idle_tpus
+        ):
+            msg = f"[{prefix}] [RESERVED] {name} ({zone}) reserved by {reservations[name][0]} (cached)"
+            fut = Future()
+            fut.set_result((prefix, name, zone, "RESERVED", msg, None))
+            check_futures.append(fut)
+            continue
 
-    # Add delete tasks
-    if all_preempted:
-        logging.info(
-            f"Found {len(all_preempted)} PREEMPTED TPU(s), deleting in parallel with checks..."
+        consec_fail = health.get(name, {}).get("consec_fail", 0)
+        task["fast_fail"] = (
+            consec_fail >= HEALTH_FAIL_THRESHOLD
+            and consec_fail % HEALTH_FULL_CHECK_EVERY != 0
         )
-        all_tasks.extend(all_preempted)
-
-    # Add check tasks
-    all_tasks.extend(all_tpus)
+        if task["fast_fail"]:
+            fast_fail_names.add(name)
+        check_futures.append(pool.submit(process_task, task))
 
-    if not all_tasks:
-        logging.info("No tasks to execute.")
+    if not delete_futures and not check_futures:
+        logging.info("No TPU found.")
         return
 
-    # Execute all tasks in parallel: deletes + checks
-    with Pool(MAX_WORKERS) as pool:
-        all_results = pool.map(process_task, all_tasks)
-
-    # Separate delete results and check results
-    delete_results = []
-    check_results = []
+    if delete_futures:
+        logging.info(
+            f"Found {len(delete_futures)} PREEMPTED TPU(s), deleting in parallel with checks..."
+        )
 
-    for i, result in enumerate(all_results):
-        if i < len(all_preempted):
-            # This is a delete result
-            delete_results.append(result)
-        else:
-            # This is a check result
-            check_results.append(result)
-
-    # Phase 2.3: Delete TPUs that are TIMEOUT in BOTH current run and cache (previous run).
-    cache_timeout_tpus = _read_cache_timeout_tpus()
-    persistent_timeout_tasks = [
-        {"name": name, "zone": zone, "state": "TIMEOUT"}
-        for _, name, zone, status, _, _ in check_results
-        if status == "TIMEOUT" and name in cache_timeout_tpus
-    ]
+    # Phase 2.3: as each check finishes, TPUs whose full-budget check is TIMEOUT now
+    # and was TIMEOUT last time too (previous run's cache, or the last full-budget
+    # check in the health file, which may be a few runs back for fast_fail TPUs) get
+    # their delete submitted right away, instead of waiting for the slowest check.
+    # Results keep their listing order for the summary.
+    check_results = [None] * len(check_futures)
+    index_of = {f: i for i, f in enumerate(check_futures)}
+    persistent_timeout_tasks = []
+    timeout_del_futures = []
+    # Per-TPU health for the next run; only TPUs listed this run are kept.
+    new_health = {}
+    now_ts = time.time()
+    for f in as_completed(check_futures):
+        result = f.result()
+        check_results[index_of[f]] = result
+        _, name, zone, status, _, _ = result
+        entry = health.get(name, {"last_ok": None, "consec_fail": 0, "full_timeout": False})
+        if status in ("IDLE", "BUSY"):
+            entry = {"last_ok": now_ts, "consec_fail": 0, "full_timeout": False}
+        elif status in ("SSH_FAIL", "TIMEOUT", "ERROR"):
+            entry = {
+                "last_ok": entry.get("last_ok"),
+                "consec_fail": entry.get("consec_fail", 0) + 1,
+                "full_timeout": (
+                    entry.get("full_timeout", False)
+                    if name in fast_fail_names
+                    else status == "TIMEOUT"
+                ),
+            }
+        new_health[name] = entry
+        if status == "TIMEOUT" and (
+            name in cache_timeout_tpus
+            or health.get(name, {}).get("full_timeout", False)
+        ):
+            task = {"name": name, "zone": zone, "state": "TIMEOUT"}
+            persistent_timeout_tasks.append(task)
+            timeout_del_futures.append(pool.submit(delete_preempted_tpu, task))
+
+    _write_health(new_health)
+
+    delete_results = [f.result() for f in delete_futures]
+
+    deleted_names = set()
     if persistent_timeout_tasks:
         logging.info(
-            f"[TIMEOUT_DELETE] {len(persistent_timeout_tasks)} TPU(s) were TIMEOUT last run too, deleting: "
+            f"[TIMEOUT_DELETE] {len(persistent_timeout_tasks)} TPU(s) timed out on their last full check too, deleting: "
             + ", ".join(t["name"] for t in persistent_timeout_tasks)
         )
-        with Pool(min(MAX_WORKERS, len(persistent_timeout_tasks))) as pool:
-            timeout_del_results = pool.map(delete_preempted_tpu, persistent_timeout_tasks)
-        deleted_names = set()
-        for del_status, del_name, del_zone in timeout_del_results:
-            logging.info(f"[TIMEOUT_DELETE] {del_name} ({del_zone}): {del_status}")
+        timeout_del_results = [f.result() for f in timeout_del_futures]
+        log_lines = []
+        for del_status, del_name, del_zone, _ in timeout_del_results:
+            # DELETE_SUCCESS only means the --async delete was started.
             if del_status == "DELETE_SUCCESS":
                 deleted_names.add(del_name)
-        # Update status for successfully deleted TPUs
-        if deleted_names:
-            check_results = [
-                (prefix, name, zone,
-                 "TIMEOUT_DELETED", f"[{prefix}] [TIMEOUT_DELETED] {name} ({zone})", disk_mounted)
-                if name in deleted_names
-                else (prefix, name, zone, status, msg, disk_mounted)
-                for prefix, name, zone, status, msg, disk_mounted in check_results
-            ]
-
-    # Phase 2.5: scan lock directory once, then mark reserved idle TPUs.
-    reservations = collect_recent_reservations()
-    if reservations:
-        marked_results = []
-        for prefix, name, zone, status, msg, disk_mounted in check_results:
-            if status == "IDLE" and name in reservations:
-                user = reservations[name]
-                status = "RESERVED"
-                msg = f"[{prefix}] [RESERVED] {name} ({zone}) reserved by {user}"
-            marked_results.append((prefix, name, zone, status, msg, disk_mounted))
-        check_results = marked_results
+                log_lines.append(f"[TIMEOUT_DELETE] {del_name} ({del_zone}): delete started")
+            else:
+                log_lines.append(f"[TIMEOUT_DELETE] {del_name} ({del_zone}): {del_status}")
+        logging.info("\n".join(log_lines))
 
     # Log deletion summary if any
     if delete_results:
         success = sum(1 for r in delete_results if r[0] == "DELETE_SUCCESS")
         failed = len(delete_results) - success
-        logging.info(f"[DELETE] Summary: {success} deleted, {failed} failed")
-
-    # Phase 3: summary by prefix (including OTHER if any)
-    by_prefix = defaultdict(list)
-    for r in check_results:
-        by_prefix[r[0]].append(r)
-
-    # Collect IDLE TPUs whose disk is not yet mounted and schedule background mounts.
-    tpus_to_mount = [
-        (name, zone)
-        for _, name, zone, status, _, disk_mounted in check_results
-        if status == "IDLE" and disk_mounted is False
-        and not _should_skip_auto_register_mount(name)
-    ]
+        log_lines = [r[3] for r in delete_results]
+        log_lines.append(f"[DELETE] Summary: {success} delete(s) started, {failed} failed")
+        logging.info("\n".join(log_lines))
+
+    # Phase 2.5 + 3 in one pass over the check results: mark TPUs deleted for TIMEOUT
+    # and reserved idle TPUs, bucket them by prefix with running counts, and collect
+    # IDLE TPUs whose disk is not yet mounted for background mounts.
+    reservations = reservations_future.result()
+    groups = {
+        pfx: {"msgs": [], "idle": 0, "reserved": 0, "busy": 0, "bad": 0}
+        for pfx in [*prefixes, OTHER_PREFIX]
+    }
+    tpus_to_mount = []
+    for prefix, name, zone, status, msg, disk_mounted in check_results:
+        if name in deleted_names:
+            status = "TIMEOUT_DELETED"
+            msg = f"[{prefix}] [TIMEOUT_DELETED] {name} ({zone})"
+        elif status == "IDLE" and name in reservations:
+            status = "RESERVED"
+            msg = f"[{prefix}] [RESERVED] {name} ({zone}) reserved by {reservations[name][0]}"
+
+        group = groups[prefix]
+        group["msgs"].append(msg)
+        if status == "IDLE":
+            group["idle"] += 1
+            if disk_mounted is False and not _should_skip_auto_register_mount(name):
+                tpus_to_mount.append((name, zone))
+        elif status == "RESERVED":
+            group["reserved"] += 1
+        elif status == "BUSY":
+            group["busy"] += 1
+        elif status in BAD_STATUSES:
+            group["bad"] += 1
 
     logging.info("========== SUMMARY ==========")
 
     # Ensure we print in requested order + OTHER at the end (only if exists)
     ordered_prefixes = list(prefixes)
-    if by_prefix.get(OTHER_PREFIX):
+    if groups[OTHER_PREFIX]["msgs"]:
         ordered_prefixes.append(OTHER_PREFIX)
 
     total_all = 0
     idle_all = 0
 
-    for idx, pfx in enumerate(ordered_prefixes):
-        items = by_prefix.get(pfx, [])
-        if not items:
+    for pfx in ordered_prefixes:
+        group = groups[pfx]
+        msgs = group["msgs"]
+        if not msgs:
             continue
 
-        total = len(items)
-        idle = sum(1 for x in items if x[3] == "IDLE")
-        reserved = sum(1 for x in items if x[3] == "RESERVED")
-        busy = sum(1 for x in items if x[3] == "BUSY")
-        bad = sum(1 for x in items if x[3] in {"ERROR", "TIMEOUT", "SSH_FAIL", "TIMEOUT_DELETED"})
+        total = len(msgs)
+        idle = group["idle"]
+        reserved = group["reserved"]
+        busy = group["busy"]
+        bad = group["bad"]
 
         total_all += total
         idle_all += idle
 
-        # Divider between groups
-        if idx != 0:
-            logging.info("-------")
-
+        # One log record per group: header, per-TPU lines and the trailing divider
+        # joined together, so the header line carries the timestamp.
         header = "[OTHER]" if pfx == OTHER_PREFIX else f"[{pfx}]"
         reserved_part = f", reserved {reserved}" if reserved else ""
-        logging.info(
-            f"{header} total {total}, idle {idle}{reserved_part}, busy {busy}, bad {bad}"
-        )
+        lines = [f"{header} total {total}, idle {idle}{reserved_part}, busy {busy}, bad {bad}"]
 
         # Per-TPU lines
-        for _, name, _, _, msg, _ in items:
-            logging.info(msg)
+        lines.extend(msgs)
+        lines.append("-------")
+        logging.info("\n".join(lines))
 
-    logging.info("-------")
     logging.info(f"[ALL] total {total_all}, idle {idle_all}")
 
     if tpus_to_mount:
@@ -625,14 +875,17 @@ def run_audit_all(prefixes):
 
 
 if __name__ == "__main__":
+    POOL = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    atexit.register(POOL.shutdown)
+
     t0 = time.time()
-    run_audit_all(PREFIXES)
+    run_audit_all(PREFIXES, POOL)
     logging.info(f"Audit finished in {time.time() - t0:.2f}s")
 
     # Optional periodic run:
     # while True:
     #     start = time.time()
-    #     run_audit_all(PREFIXES)
+    #     run_audit_all(PREFIXES, POOL)
     #     elapsed = time.time() - start
     #     if elapsed < CHECK_INTERVAL:
     #         time.sleep(CHECK_INTERVAL - elapsed)